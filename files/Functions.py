@@ -2,12 +2,22 @@
 # by the online generalized ST algorithm implemented in TreeBuilder.
 
 
+import contextlib
+import io
+import sys
+from collections import OrderedDict
+
 from TreeBuilder import OnlineGeneralizedSuffixTree
 
 
 class SuffixTree(OnlineGeneralizedSuffixTree):
     """A class to implement ways to interact with the tree built by OnlineGeneralizedSuffixTree.
     ...
+    Attributes
+    ----------
+    query_cache: QueryCache
+        cache of the outputs of is_pattern_present and find_patterns_* queries
+
     Methods
     -------
     add_sequence(sequence, sequence_index)
@@ -17,15 +27,117 @@ class SuffixTree(OnlineGeneralizedSuffixTree):
         Note that 'sequence' can be a string or a list of tokens (alarms, events...).
     draw_tree(node, repr_edge, last)
         Print the tree rooted at node 'node' ('repr_edge' and 'last' used for recursion).
-    is_pattern_present(pattern, node)
+    is_pattern_present(pattern, node, use_cache)
         Check if the pattern 'pattern' is present in the tree rooted at node 'node'.
-    find_patterns_appear_more_than_n_times(n_times, node)
+    find_patterns_appear_more_than_n_times(n_times, node, use_cache)
         Find the patterns that appear more than 'n_times' times in the tree rooted at node 'node'.
-    find_patterns_longer_than_length_appear_more_than_n_times(length, n_times, node)
+    find_patterns_longer_than_length_appear_more_than_n_times(length, n_times, node, use_cache)
         Find the patterns of length at least 'length' that appear more than
         'n_times' times  in the tree rooted at node 'node'.
+    clear_query_cache()
+        Remove every output from the query cache.
+    find_approximate_patterns(pattern, k, distance, bit_parallel)
+        Find the patterns within Hamming distance or edit distance 'k' of 'pattern' in the tree.
+    run_cached_query(key, query)
+        Print the cached output of the query 'key' if still valid, otherwise run 'query' and cache its output.
     """
 
+    def __init__(self, sequences=None, active_sequence='sequence0', active_points=None, created_nodes_during_step=None, query_cache_max_entries: int = 256, query_cache_max_bytes: int = 2 ** 20):
+        """
+        Parameters
+        ----------
+        sequences, active_sequence, active_points, created_nodes_during_step
+            see OnlineGeneralizedSuffixTree
+        query_cache_max_entries: int
+            maximum number of query outputs kept in the cache
+        query_cache_max_bytes: int
+            maximum size (in bytes) of the query cache entries (outputs, keys and dependencies)
+        """
+        super().__init__(sequences, active_sequence, active_points, created_nodes_during_step)
+        self.query_cache = self.QueryCache(max_entries=query_cache_max_entries, max_bytes=query_cache_max_bytes)
+
+    class QueryCache(object):
+        """
+        A least recently used cache of query outputs, invalidated by the versions of the
+        nodes and sequences the output depends on
+        ...
+        Attributes
+        ----------
+        max_entries: int
+            maximum number of outputs kept in the cache
+        max_bytes: int
+            maximum size (in bytes) of the entries kept in the cache
+        entries: OrderedDict{key=query key, value=(output, node_dependencies, sequence_dependencies, size)}
+            cached outputs, from the least to the most recently used. 'node_dependencies' is a list of
+            (node, version attribute, version) and 'sequence_dependencies' a dictionary {sequence_index: version}
+        size: int
+            size (in bytes) of the entries in the cache: their keys, outputs and dependency lists
+            and dictionaries (the nodes the dependencies refer to belong to the tree and are not counted)
+        """
+
+        def __init__(self, max_entries: int = 256, max_bytes: int = 2 ** 20):
+            """
+            Parameters
+            ----------
+            max_entries: int
+                maximum number of outputs kept in the cache
+            max_bytes: int
+                maximum size (in bytes) of the entries kept in the cache
+            """
+
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+            self.entries = OrderedDict()
+            self.size = 0
+
+        def get(self, key, sequence_versions):
+            """ Return the output cached for 'key', or None if there is none or if one of
+            the nodes or sequences (versions in 'sequence_versions') it depends on changed since. """
+            if key not in self.entries:
+                return None
+            output, node_dependencies, sequence_dependencies, size = self.entries[key]
+            if any(getattr(node, attribute) != version for node, attribute, version in node_dependencies) or any(sequence_versions.get(sequence_index) != sequence_dependencies[sequence_index] for sequence_index in sequence_dependencies):
+                self.remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return output
+
+        def put(self, key, output, node_dependencies, sequence_dependencies):
+            """ Cache 'output' for 'key' and evict the least recently used outputs
+            until the cache fits in 'max_entries' and 'max_bytes'. """
+            if key in self.entries:
+                self.remove(key)
+            size = self.entry_size(key, output, node_dependencies, sequence_dependencies)
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (output, node_dependencies, sequence_dependencies, size)
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+
+        @staticmethod
+        def entry_size(key, output, node_dependencies, sequence_dependencies):
+            """ Return the size (in bytes) of a cache entry: its key (and the elements of the key),
+            its output and its dependencies (without the nodes they refer to). """
+            size = sys.getsizeof(key)
+            for element in key:
+                if isinstance(element, str):
+                    size += sys.getsizeof(element)
+                elif isinstance(element, tuple):
+                    size += sys.getsizeof(element) + sum(sys.getsizeof(token) for token in element)
+            size += sys.getsizeof(output) + sys.getsizeof(node_dependencies) + sys.getsizeof(sequence_dependencies)
+            size += sum(sys.getsizeof(dependency) for dependency in node_dependencies)
+            return size
+
+        def remove(self, key):
+            """ Remove the output cached for 'key'. """
+            self.size -= self.entries.pop(key)[3]
+
+        def clear(self):
+            """ Remove every output from the cache. """
+            self.entries.clear()
+            self.size = 0
+
     def add_sequence(self, sequence, sequence_index='sequence0'):
         """Append 'sequence' to the string 'self.sequences[sequence_index]'
         (prepare the tree to receive a new sequence if 'sequence_index' is not a key
@@ -43,6 +155,8 @@ class SuffixTree(OnlineGeneralizedSuffixTree):
             self.sequences[self.active_sequence].append(letter)
             self.created_nodes_during_step = []
             self.active_points[self.active_sequence].remainder += 1
+            self.version += 1
+            self.sequence_versions[self.active_sequence] = self.version
             self.insert_suffix()
 
     def draw_tree(self, node=None, repr_edge='|', last=False):
@@ -75,34 +189,66 @@ class SuffixTree(OnlineGeneralizedSuffixTree):
         for edge in node.edges:
             self.draw_tree(edge.node_to, repr_edge, edge == node.edges[-1])
 
-    def is_pattern_present(self, pattern, node=None):
+    def is_pattern_present(self, pattern, node=None, use_cache=True):
         """Check if the pattern 'pattern' is present in the subtree rooted at 'node'.
-        If 'node' is not specified, check for the entire tree.
+        If 'node' is not specified, check for the entire tree. The answer only depends on
+        the nodes along the path of 'pattern' (and the leaves' sequences), and is cached
+        until one of them changes if 'use_cache'.
         pattern: str
         node: Node
+        use_cache: bool
+        """
+        if use_cache:
+            self.run_cached_query(('is_pattern_present', type(pattern), tuple(pattern), node), lambda dependencies: self._is_pattern_present(pattern, node, dependencies))
+        else:
+            self._is_pattern_present(pattern, node, ([], {}))
+
+    def _is_pattern_present(self, pattern, node, dependencies):
+        """ See is_pattern_present.
+        dependencies: ([(Node, str, int)], {sequence_index: int}), filled with the nodes and sequences the answer depends on
         """
         if node is None:
             node = self.root
             print(f'\nThe pattern \"{pattern}\"', end='')
+        dependencies[0].append((node, 'version', node.version))
         for edge in node.edges:
-            if pattern[0:min(len(pattern), self.length(edge))] == ''.join(self.sequences[edge.canonical_sequence][edge.canonical_range[0]: min(edge.canonical_range[0] + len(pattern), edge.canonical_range[1])]):
+            if pattern[0:min(len(pattern), self.length(edge))] == ''.join(self.sequences[edge.canonical_sequence][edge.canonical_range[0]: edge.canonical_range[0] + min(len(pattern), self.length(edge))]):
+                # Only a pattern running to the open end of a leaf edge depends on the sequence growing
+                if edge.canonical_range[1] == -1 and self.length(edge) <= len(pattern):
+                    dependencies[1][edge.canonical_sequence] = self.sequence_versions[edge.canonical_sequence]
                 if self.length(edge) < len(pattern):
-                    return self.is_pattern_present(pattern=pattern[self.length(edge):], node=edge.node_to)
+                    return self._is_pattern_present(pattern[self.length(edge):], edge.node_to, dependencies)
                 else:
+                    dependencies[0].append((edge.node_to, 'version', edge.node_to.version))
                     print(f' is present in "sequences" and appears at positions {edge.node_to.starting_positions}.')
                     return
         print(' is not present in "sequences".')
 
-    def find_patterns_appear_more_than_n_times(self, n_times, node=None):
+    def find_patterns_appear_more_than_n_times(self, n_times, node=None, use_cache=True):
         """ Find the patterns that appear more than 'n_times' times in the subtree rooted
-        at node 'node'. If 'node' is not specified, check for the entire tree.
+        at node 'node'. If 'node' is not specified, check for the entire tree. The answer is
+        cached until the subtree (or the sequences of its leaves) changes if 'use_cache'.
         n_times: int
         node: Node
+        use_cache: bool
+        """
+        if use_cache:
+            self.run_cached_query(('find_patterns_appear_more_than_n_times', n_times, node), lambda dependencies: self._find_patterns_appear_more_than_n_times(n_times, node, dependencies))
+        else:
+            self._find_patterns_appear_more_than_n_times(n_times, node, ([], {}))
+
+    def _find_patterns_appear_more_than_n_times(self, n_times, node, dependencies):
+        """ See find_patterns_appear_more_than_n_times.
+        dependencies: ([(Node, str, int)], {sequence_index: int}), filled with the nodes and sequences the answer depends on
         """
         if node is None:
             print(f'\nPatterns that appear more than {n_times} times:')
             node = self.root
+        if not dependencies[0]:
+            dependencies[0].append((node, 'subtree_version', node.subtree_version))
         for edge in node.edges:
+            if edge.canonical_range[1] == -1:
+                dependencies[1][edge.canonical_sequence] = self.sequence_versions[edge.canonical_sequence]
             node_occurrences = 0
             for sequence_index in edge.node_to.starting_positions:
                 node_occurrences += len(edge.node_to.starting_positions[sequence_index])
@@ -113,19 +259,34 @@ class SuffixTree(OnlineGeneralizedSuffixTree):
                 else:
                     print(
                         f'    The pattern \"{"".join(self.sequences[edge.canonical_sequence][edge.canonical_range[1] - edge.node_to.depth: edge.canonical_range[1]])}\" appears {node_occurrences} times at positions: {edge.node_to.starting_positions}.')
-                    self.find_patterns_appear_more_than_n_times(n_times, edge.node_to)
+                    self._find_patterns_appear_more_than_n_times(n_times, edge.node_to, dependencies)
 
-    def find_patterns_longer_than_length_appear_more_than_n_times(self, length, n_times, node=None):
+    def find_patterns_longer_than_length_appear_more_than_n_times(self, length, n_times, node=None, use_cache=True):
         """ Find the patterns of length at least 'length' that appear more than 'n_times'
         times  in the subtree rooted at node 'node'. If 'node' is not specified, check for the entire tree.
+        The answer is cached until the subtree (or the sequences of its leaves) changes if 'use_cache'.
         length: int
         n_times: int
         node: Node
+        use_cache: bool
+        """
+        if use_cache:
+            self.run_cached_query(('find_patterns_longer_than_length_appear_more_than_n_times', length, n_times, node), lambda dependencies: self._find_patterns_longer_than_length_appear_more_than_n_times(length, n_times, node, dependencies))
+        else:
+            self._find_patterns_longer_than_length_appear_more_than_n_times(length, n_times, node, ([], {}))
+
+    def _find_patterns_longer_than_length_appear_more_than_n_times(self, length, n_times, node, dependencies):
+        """ See find_patterns_longer_than_length_appear_more_than_n_times.
+        dependencies: ([(Node, str, int)], {sequence_index: int}), filled with the nodes and sequences the answer depends on
         """
         if node is None:
             print(f'\nPatterns longer than {length} that appear more than {n_times} times:')
             node = self.root
+        if not dependencies[0]:
+            dependencies[0].append((node, 'subtree_version', node.subtree_version))
         for edge in node.edges:
+            if edge.canonical_range[1] == -1:
+                dependencies[1][edge.canonical_sequence] = self.sequence_versions[edge.canonical_sequence]
             node_occurrences = 0
             for sequence_index in edge.node_to.starting_positions:
                 node_occurrences += len(edge.node_to.starting_positions[sequence_index])
@@ -136,4 +297,164 @@ class SuffixTree(OnlineGeneralizedSuffixTree):
                 else:
                     if edge.node_to.depth >= length:
                         print(f'    The pattern \"{"".join(self.sequences[edge.canonical_sequence][edge.canonical_range[1] - edge.node_to.depth: edge.canonical_range[1]])}\" appears {node_occurrences} times at positions: {edge.node_to.starting_positions}.')
-                    self.find_patterns_longer_than_length_appear_more_than_n_times(length, n_times, edge.node_to)
+                    self._find_patterns_longer_than_length_appear_more_than_n_times(length, n_times, edge.node_to, dependencies)
+
+    def clear_query_cache(self):
+        """ Remove every output from the query cache. """
+        self.query_cache.clear()
+
+    def find_approximate_patterns(self, pattern, k, distance='hamming', bit_parallel=False):
+        """ Find the patterns within distance 'k' of 'pattern' in the tree, 'distance' being either
+        'hamming' (substitutions only) or 'edit' (substitutions, insertions and deletions).
+        The tree is traversed depth first from the root and a branch is pruned as soon as no
+        extension of its path can be within distance 'k' of 'pattern' (Hamming: more than 'k'
+        mismatches; edit: every cell of the dynamic programming row is above 'k', or the path is
+        longer than len(pattern) + k). With 'bit_parallel' (edit distance only), edit distance rows are updated with
+        Myers' bit-vector algorithm over the pattern's symbols encoded as integer bit masks, in
+        O(len(pattern) / word size) per character instead of O(len(pattern)), the row minimum
+        (O(len(pattern))) being only checked at the nodes.
+        Return a dictionary {matched_pattern: {'distance', 'count', 'positions'}}, 'matched_pattern'
+        being the tuple of the matched characters/tokens.
+        pattern: str (or list[tokens])
+        k: int
+        distance: str
+        bit_parallel: bool
+        """
+        if not pattern:
+            raise ValueError('Expected a non empty pattern.')
+        if k < 0:
+            raise ValueError(f'Expected a non negative distance "k", got {k}.')
+        if distance == 'hamming':
+            if bit_parallel:
+                raise ValueError('"bit_parallel" only applies to the "edit" distance.')
+            max_depth = len(pattern)
+            initial_state = 0
+            advance = self._advance_hamming_state(pattern)
+        elif distance == 'edit':
+            max_depth = len(pattern) + k
+            if bit_parallel:
+                initial_state = ((1 << len(pattern)) - 1, 0, len(pattern))
+                advance = self._advance_bit_parallel_edit_state(pattern)
+            else:
+                initial_state = list(range(len(pattern) + 1))
+                advance = self._advance_edit_state(pattern)
+        else:
+            raise ValueError(f'Unknown distance "{distance}", expected "hamming" or "edit".')
+        print(f'\nPatterns within {distance} distance {k} of \"{"".join(pattern)}\":')
+        matches = {}
+        # Iterative depth first traversal: (edge, depth of edge.node_from, state at edge.node_from, path label)
+        stack = [(edge, 0, initial_state, ()) for edge in reversed(self.root.edges)]
+        while stack:
+            edge, depth, state, path = stack.pop()
+            sequence = self.sequences[edge.canonical_sequence]
+            start = edge.canonical_range[0]
+            alive = True
+            for offset in range(self.length(edge)):
+                if depth == max_depth:
+                    alive = False
+                    break
+                depth += 1
+                state, score, alive = advance(state, sequence[start + offset], depth, k)
+                if score <= k and (distance == 'edit' or depth == len(pattern)):
+                    matched_pattern = path + tuple(sequence[start:start + offset + 1])
+                    positions = {sequence_index: list(edge.node_to.starting_positions[sequence_index]) for sequence_index in edge.node_to.starting_positions if edge.node_to.starting_positions[sequence_index]}
+                    matches[matched_pattern] = {'distance': score, 'count': sum(len(positions[sequence_index]) for sequence_index in positions), 'positions': positions}
+                if not alive:
+                    break
+            if alive and depth < max_depth:
+                if distance == 'edit' and bit_parallel and self._bit_parallel_edit_row_minimum(state, depth) > k:
+                    continue
+                path = path + tuple(sequence[start:start + self.length(edge)])
+                for child_edge in reversed(edge.node_to.edges):
+                    stack.append((child_edge, depth, state, path))
+        for matched_pattern in matches:
+            print(f'    The pattern \"{"".join(matched_pattern)}\" (distance {matches[matched_pattern]["distance"]}) appears {matches[matched_pattern]["count"]} times at positions: {matches[matched_pattern]["positions"]}.')
+        if not matches:
+            print('    No pattern found.')
+        return matches
+
+    def _advance_hamming_state(self, pattern):
+        """ Return the function extending a path by one character for the Hamming distance to 'pattern':
+        the state is the number of mismatches on the path.
+        pattern: str (or list[tokens])
+        """
+        def advance(mismatches, letter, depth, k):
+            if letter != pattern[depth - 1]:
+                mismatches += 1
+            return mismatches, mismatches, mismatches <= k
+        return advance
+
+    def _advance_edit_state(self, pattern):
+        """ Return the function extending a path by one character for the edit distance to 'pattern':
+        the state is the dynamic programming row [edit distance between pattern[:i] and the path].
+        pattern: str (or list[tokens])
+        """
+        def advance(row, letter, depth, k):
+            new_row = [depth]
+            for i in range(1, len(pattern) + 1):
+                new_row.append(min(row[i - 1] + (pattern[i - 1] != letter), row[i] + 1, new_row[i - 1] + 1))
+            return new_row, new_row[-1], min(new_row) <= k
+        return advance
+
+    def _advance_bit_parallel_edit_state(self, pattern):
+        """ Return the function extending a path by one character for the edit distance to 'pattern'
+        with Myers' bit-vector algorithm: the state is (vertical positive deltas, vertical negative
+        deltas, edit distance between the pattern and the path), bit i standing for row i + 1.
+        Every symbol of the pattern is encoded as the integer mask of the rows it appears at.
+        pattern: str (or list[tokens])
+        """
+        mask = (1 << len(pattern)) - 1
+        last_row = 1 << (len(pattern) - 1)
+        pattern_masks = {}
+        for i, letter in enumerate(pattern):
+            pattern_masks[letter] = pattern_masks.get(letter, 0) | (1 << i)
+
+        def advance(state, letter, depth, k):
+            positive_vertical, negative_vertical, score = state
+            equal = pattern_masks.get(letter, 0)
+            crossed_vertical = equal | negative_vertical
+            crossed_horizontal = ((((equal & positive_vertical) + positive_vertical) ^ positive_vertical) | equal) & mask
+            positive_horizontal = (negative_vertical | ~(crossed_horizontal | positive_vertical)) & mask
+            negative_horizontal = positive_vertical & crossed_horizontal
+            if positive_horizontal & last_row:
+                score += 1
+            elif negative_horizontal & last_row:
+                score -= 1
+            # The first row is the length of the path: its horizontal delta is always +1
+            positive_horizontal = (positive_horizontal << 1) | 1
+            negative_horizontal = negative_horizontal << 1
+            positive_vertical = (negative_horizontal | ~(crossed_vertical | positive_horizontal)) & mask
+            negative_vertical = positive_horizontal & crossed_vertical & mask
+            return (positive_vertical, negative_vertical, score), score, True
+        return advance
+
+    def _bit_parallel_edit_row_minimum(self, state, depth):
+        """ Return the minimum of the dynamic programming row encoded by the bit-vector 'state'
+        of a path of length 'depth' (see _advance_bit_parallel_edit_state).
+        state: (int, int, int)
+        depth: int
+        """
+        positive_vertical, negative_vertical, score = state
+        value = minimum = depth
+        while positive_vertical or negative_vertical:
+            value += (positive_vertical & 1) - (negative_vertical & 1)
+            minimum = min(minimum, value)
+            positive_vertical >>= 1
+            negative_vertical >>= 1
+        return minimum
+
+    def run_cached_query(self, key, query):
+        """ Print the output cached for the query 'key' if none of the nodes or sequences it
+        depends on changed since, otherwise run 'query' (called with the dependencies to fill),
+        print its output and cache it.
+        key: tuple
+        query: function
+        """
+        output = self.query_cache.get(key, self.sequence_versions)
+        if output is None:
+            dependencies = ([], {})
+            with contextlib.redirect_stdout(io.StringIO()) as buffer:
+                query(dependencies)
+            output = buffer.getvalue()
+            self.query_cache.put(key, output, *dependencies)
+        print(output, end='')
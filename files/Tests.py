@@ -22,6 +22,17 @@ if __name__ == '__main__':
     t.find_patterns_appear_more_than_n_times(10)
     t.find_patterns_longer_than_length_appear_more_than_n_times(5, 3)
     t.is_pattern_present('ananas')
+    t.find_approximate_patterns('ananas', 1)
+    t.find_approximate_patterns('bananas', 1, distance='edit', bit_parallel=True)
+    # Repeated queries replay their cached output until the nodes or sequences they depend on change
+    t.is_pattern_present('ananas')
+    t.add_sequence(['i', 's', 's', 'i'], 'river')
+    t.is_pattern_present('ananas')
+    t.is_pattern_present('issi')
+    t.find_patterns_appear_more_than_n_times(10)
+    # The cache never changes an answer: the same pattern as a list of tokens is not mistaken for the string
+    t.is_pattern_present(['a', 'n', 'a', 'n', 'a', 's'])
+    t.is_pattern_present(['a', 'n', 'a', 'n', 'a', 's'], use_cache=False)
     # The results presented here will be missing everything that has yet to be inserted because of an active_point being
     # on an edge. If you want to include those, there are two options: adding a final character to every sequence, or
     # recursively build the suffix trees of the non covered parts)
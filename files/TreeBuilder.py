@@ -14,6 +14,12 @@ class OnlineGeneralizedSuffixTree(object):
          dictionary of the different active points in the tree, indexed on their sequence_index
      created_nodes_during_step : [Nodes]
          list of the nodes created during one step of the algorithm
+     version : int
+         modification version of the tree, bumped once per character appended to a sequence
+         (before the calls to insert_suffix that character triggers)
+     sequence_versions : {key=sequence_index, value=int}
+         version of the tree at the last insertion in each sequence (the leaves' edges of
+         that sequence are longer since then)
 
      Methods
      -------
@@ -36,6 +42,8 @@ class OnlineGeneralizedSuffixTree(object):
      solve_floating_leaves():
          move the floating leafs along their respective edges/nodes and split the edge if an edge doesn't
          match the inserted character
+     update_node_version(node):
+         mark the node 'node' as modified at the current version, and its subtree as well as its ancestors' ones
      """
 
     def __init__(self, sequences=None, active_sequence='sequence0', active_points=None, created_nodes_during_step=None):
@@ -64,6 +72,8 @@ class OnlineGeneralizedSuffixTree(object):
         if created_nodes_during_step is None:
             created_nodes_during_step = []
         self.created_nodes_during_step = created_nodes_during_step
+        self.version = 0
+        self.sequence_versions = {}
 
     class Node(object):
         """
@@ -82,9 +92,13 @@ class OnlineGeneralizedSuffixTree(object):
             from the root to that node)
         starting_positions: {sequence_index: [int]}
             list of the starting positions of the suffix in the different sequences (indexed as sequences)
+        version: int
+            version of the tree at the last modification of the node (outgoing edges or starting positions)
+        subtree_version: int
+            version of the tree at the last modification of a node in the subtree rooted at that node
         """
 
-        def __init__(self, edges=None, incoming_edge=None, suffix_link_to=None, depth: int = -1, starting_positions=None):
+        def __init__(self, edges=None, incoming_edge=None, suffix_link_to=None, depth: int = -1, starting_positions=None, version: int = 0, subtree_version: int = 0):
             """
             Parameters
             ----------
@@ -99,6 +113,10 @@ class OnlineGeneralizedSuffixTree(object):
                 from the root to that node)
             starting_positions: {sequence_index: [int]}
                 list of the starting positions of the suffix in the different sequences (indexed as sequences)
+            version: int
+                version of the tree at the last modification of the node (outgoing edges or starting positions)
+            subtree_version: int
+                version of the tree at the last modification of a node in the subtree rooted at that node
             """
 
             if edges is None:
@@ -112,6 +130,8 @@ class OnlineGeneralizedSuffixTree(object):
             if starting_positions is None:
                 starting_positions = {}
             self.starting_positions = starting_positions
+            self.version = version
+            self.subtree_version = subtree_version
 
     class Edge(object):
         """
@@ -337,6 +357,8 @@ class OnlineGeneralizedSuffixTree(object):
                     floating_active_points_indices.append(active_sequence)
         old_edge.node_to = middle_node
         middle_node.incoming_edge = old_edge
+        self.update_node_version(middle_node)
+        self.update_node_version(old_edge.node_from)
         while floating_active_points_indices:
             self.active_points[floating_active_points_indices.pop(0)].active_edge = new_edge
 
@@ -355,6 +377,8 @@ class OnlineGeneralizedSuffixTree(object):
         new_node.incoming_edge = new_edge
         new_node.starting_positions[self.active_sequence] = []
         new_node.starting_positions[self.active_sequence].append(starting_position)
+        self.update_node_version(new_node)
+        self.update_node_version(node_from)
         # Setting up suffix links in Ukkonen's fashion
         if self.created_nodes_during_step and node_from != self.root:
             self.created_nodes_during_step[0].suffix_link_to = node_from
@@ -373,6 +397,7 @@ class OnlineGeneralizedSuffixTree(object):
                 if self.active_sequence not in self.active_points[self.active_sequence].active_node.starting_positions:
                     self.active_points[self.active_sequence].active_node.starting_positions[self.active_sequence] = []
                 self.active_points[self.active_sequence].active_node.starting_positions[self.active_sequence].append(len(self.sequences[self.active_sequence]) - active_node.depth - 1 - self.active_points[self.active_sequence].active_length)
+                self.update_node_version(self.active_points[self.active_sequence].active_node)
                 self.active_points[self.active_sequence].active_node = self.active_points[self.active_sequence].active_node.incoming_edge.node_from
             self.active_points[self.active_sequence].active_node = active_node
             # # Update the active edge in case the suffix link led to a more complicated branch
@@ -413,6 +438,8 @@ class OnlineGeneralizedSuffixTree(object):
                 if self.active_sequence not in self.active_points[self.active_sequence].active_edge.node_to.starting_positions:
                     self.active_points[self.active_sequence].active_edge.node_to.starting_positions[self.active_sequence] = []
                 self.active_points[self.active_sequence].active_edge.node_to.starting_positions[self.active_sequence].append(len(self.sequences[self.active_sequence]) - self.active_points[self.active_sequence].remainder)
+                self.update_node_version(self.active_points[self.active_sequence].active_edge.node_to)
+                self.update_node_version(self.active_points[self.active_sequence].active_edge.node_from)
                 self.active_points[self.active_sequence].remainder -= 1
                 # follow suffix link if any
                 if self.active_points[self.active_sequence].active_edge.node_from.suffix_link_to:
@@ -442,6 +469,7 @@ class OnlineGeneralizedSuffixTree(object):
                 if self.active_sequence not in self.active_points[self.active_sequence].active_node.starting_positions:
                     self.active_points[self.active_sequence].active_node.starting_positions[self.active_sequence] = []
                 self.active_points[self.active_sequence].active_node.starting_positions[self.active_sequence].append(min(len(self.sequences[self.active_sequence]) - 1 - self.active_points[self.active_sequence].active_node.depth - self.active_points[self.active_sequence].active_length, self.active_points[self.active_sequence].current_point - 1))
+                self.update_node_version(self.active_points[self.active_sequence].active_node)
                 # Select the next active_edge and call itself recursively if active_length is not zero
                 if self.active_points[self.active_sequence].active_length >= 1:
                     for edge in self.active_points[self.active_sequence].active_node.edges:
@@ -496,12 +524,15 @@ class OnlineGeneralizedSuffixTree(object):
                         leaf.edge.node_to.starting_positions[self.active_sequence].append(len(self.sequences[self.active_sequence]) - (leaf.edge.node_from.depth + self.length(leaf.edge)))
                         leaf.edge.canonical_range[0] = len(self.sequences[self.active_sequence]) - self.length(leaf.edge)
                         leaf.edge.canonical_range[1] = -1
+                        self.update_node_version(leaf.edge.node_to)
+                        self.update_node_version(leaf.edge.node_from)
                     # otherwise, select the next edge floating_leaf will be on if such an edge
                     # matches with the character we want to insert
                     else:
                         if leaf.sequence not in leaf.edge.node_to.starting_positions:
                             leaf.edge.node_to.starting_positions[leaf.sequence] = []
                         leaf.edge.node_to.starting_positions[leaf.sequence].append(len(self.sequences[self.active_sequence]) - leaf.edge.node_to.depth - 1)
+                        self.update_node_version(leaf.edge.node_to)
                         r = leaf.edge
                         for edge in leaf.edge.node_to.edges:
                             if self.sequences[edge.canonical_sequence][edge.canonical_range[0]] == self.sequences[self.active_sequence][-1]:
@@ -518,3 +549,12 @@ class OnlineGeneralizedSuffixTree(object):
             self.active_points[self.active_sequence].floating_leaves.remove(leaf)
             leaf.edge.floating_leaves.remove(leaf)
             del leaf
+
+    def update_node_version(self, node):
+        """ Mark the node 'node' as modified at the current version of the tree, as well as
+        the subtrees rooted at its ancestors. Stop going up as soon as an ancestor has already
+        been marked during the current version: its own ancestors are then up to date."""
+        node.version = self.version
+        while node is not None and node.subtree_version != self.version:
+            node.subtree_version = self.version
+            node = node.incoming_edge.node_from if node.incoming_edge else None